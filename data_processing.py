@@ -1,10 +1,18 @@
 import os
+import re
+import glob
 import json
 import pandas
 import matplotlib.pyplot as plt
 
 INPUT_DATA_DIRECTORY = '/home/gabriel/HaLow_Automated_Testing/results/old/1240_feet/2025-11-25_15:27:11_8MHz_CH12_21dBM_halow_test'
-INPUT_DATA_FILE_NAME = ['UDP', 'TCP']
+# Every iperf3 test set found in the input directory, e.g. 'UDP', 'TCP_Bidir' or 'TCP_Uplink_P4'.
+INPUT_DATA_FILE_NAME = sorted(
+    re.match(r'Iperf3_(.+)_Test_1\.json', os.path.basename(path)).group(1)
+    for path in glob.glob(f'{glob.escape(INPUT_DATA_DIRECTORY)}/Iperf3_*_Test_1.json')
+)
+
+DIRECTION_COLORS = {'Uplink': 'tab:orange', 'Downlink': 'tab:red'}
 
 output_dir = './graphs/'
 output_dir += '620_feet/' if INPUT_DATA_DIRECTORY.find('620_feet') != -1 else '1240_feet/'
@@ -14,63 +22,94 @@ if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
 for type in INPUT_DATA_FILE_NAME:
-    is_tcp = type == 'TCP'
-    for i in range(1, 6):
+    test_count = len(glob.glob(f'{glob.escape(INPUT_DATA_DIRECTORY)}/Iperf3_{type}_Test_*.json'))
+    for i in range(1, test_count + 1):
         with open(f'{INPUT_DATA_DIRECTORY}/Iperf3_{type}_Test_{i}.json', 'r') as file:
             data = json.load(file)
 
+        is_tcp = data['start']['test_start']['protocol'] == 'TCP'
+
         iperf3_start_time = data['start']['timestamp']['timesecs']
 
         iperf3_pandas = []
         running_timestamp = iperf3_start_time
         for entry in data['intervals']:
-            stream = entry['streams'][0]
-            iperf3_pandas.append({
-                'timestamp': running_timestamp,
-                'bytes': stream['bytes'],
-                'retransmits': stream['retransmits'] if is_tcp else 0,
-                'snd_cwnd': stream['snd_cwnd'] if is_tcp else 0,
-                'snd_wnd': stream['snd_wnd'] if is_tcp else 0,
-                'rtt': stream['rtt'] if is_tcp else 0,
-                'rttvar': stream['rttvar'] if is_tcp else 0,
-                'pmtu': stream['pmtu'] if is_tcp else 0,
+            for stream in entry['streams']:
+                # Streams the client is sending on carry data towards the server.
+                iperf3_pandas.append({
+                    'timestamp': running_timestamp,
+                    'socket': stream['socket'],
+                    'direction': 'Uplink' if stream.get('sender', True) else 'Downlink',
+                    'bytes': stream['bytes'],
+                    'retransmits': stream.get('retransmits', 0) if is_tcp else 0,
+                    'snd_cwnd': stream.get('snd_cwnd', 0) if is_tcp else 0,
+                    'snd_wnd': stream.get('snd_wnd', 0) if is_tcp else 0,
+                    'rtt': stream.get('rtt', 0) if is_tcp else 0,
+                    'rttvar': stream.get('rttvar', 0) if is_tcp else 0,
+                    'pmtu': stream.get('pmtu', 0) if is_tcp else 0,
+                })
+
+            running_timestamp += entry['sum']['seconds']
+
+        iperf3_streams_dataframe = pandas.DataFrame(iperf3_pandas)
+        iperf3_streams_dataframe['timestamp'] = pandas.to_datetime(iperf3_streams_dataframe['timestamp'], unit='s')
+
+        # Per-direction totals across all streams.
+        iperf3_direction_dataframes = {}
+        for direction, iperf3_dataframe in iperf3_streams_dataframe.groupby('direction'):
+            iperf3_dataframe = iperf3_dataframe.set_index('timestamp')
+            iperf3_dataframe = iperf3_dataframe.resample('1s').agg({
+                'bytes': 'sum',        # Summing bytes gives you the total throughput for that second
+                'retransmits': 'sum',  # Total retransmits in that second
+                'snd_cwnd': 'mean',    # Average congestion window size (or use 'max' for peak)
+                'rtt': 'mean',         # Average Round Trip Time
+                'rttvar': 'mean',      # Average Jitter
+                'pmtu': 'max'          # Constant value, max preserves it
             })
+            iperf3_dataframe['kbps'] = (iperf3_dataframe['bytes'] * 8) / 1000.0
+            iperf3_direction_dataframes[direction] = iperf3_dataframe
 
-            running_timestamp += stream['seconds']
-
-        iperf3_dataframe = pandas.DataFrame(iperf3_pandas)
-        iperf3_dataframe['timestamp'] = pandas.to_datetime(iperf3_dataframe['timestamp'], unit='s')
-        iperf3_dataframe = iperf3_dataframe.set_index('timestamp')
-        iperf3_dataframe = iperf3_dataframe.resample('1s').agg({
-            'bytes': 'sum',        # Summing bytes gives you the total throughput for that second
-            'retransmits': 'sum',  # Total retransmits in that second
-            'snd_cwnd': 'mean',    # Average congestion window size (or use 'max' for peak)
-            'rtt': 'mean',         # Average Round Trip Time
-            'rttvar': 'mean',      # Average Jitter
-            'pmtu': 'max'          # Constant value, max preserves it
-        })
-        iperf3_dataframe['kbps'] = (iperf3_dataframe['bytes'] * 8) / 1000.0
+        # Per-stream throughput.
+        iperf3_stream_dataframes = {}
+        for (socket, direction), iperf3_dataframe in iperf3_streams_dataframe.groupby(['socket', 'direction']):
+            iperf3_dataframe = iperf3_dataframe.set_index('timestamp')[['bytes']].resample('1s').sum()
+            iperf3_dataframe['kbps'] = (iperf3_dataframe['bytes'] * 8) / 1000.0
+            iperf3_stream_dataframes[(socket, direction)] = iperf3_dataframe
 
         radio_dataframe = pandas.read_csv(f'{INPUT_DATA_DIRECTORY}/Iperf3_{type}_Test_{i}.csv')
         radio_dataframe['timestamp'] = pandas.to_datetime(radio_dataframe['timestamp'], unit='ns')
         radio_dataframe = radio_dataframe.set_index('timestamp')
 
+        # Server-side radio telemetry is only present when the telemetry agent was running.
+        server_radio_dataframe = None
+        if os.path.exists(f'{INPUT_DATA_DIRECTORY}/Iperf3_{type}_Test_{i}_Server.csv'):
+            server_radio_dataframe = pandas.read_csv(f'{INPUT_DATA_DIRECTORY}/Iperf3_{type}_Test_{i}_Server.csv')
+            server_radio_dataframe['timestamp'] = pandas.to_datetime(server_radio_dataframe['timestamp'], unit='ns')
+            server_radio_dataframe = server_radio_dataframe.set_index('timestamp')
+
         # Throughput vs Signal Strength (raw data over 30s iperf window)
-        iperf_start = iperf3_dataframe.index[0]
-        iperf_end = iperf3_dataframe.index[-1]
+        iperf_start = min(iperf3_dataframe.index[0] for iperf3_dataframe in iperf3_direction_dataframes.values())
+        iperf_end = max(iperf3_dataframe.index[-1] for iperf3_dataframe in iperf3_direction_dataframes.values())
         
         # Filter radio data to iperf test window
         radio_filtered = radio_dataframe[(radio_dataframe.index >= iperf_start) & (radio_dataframe.index <= iperf_end)]
         
         # Calculate relative time for both datasets
-        iperf_relative_time = (iperf3_dataframe.index - iperf_start).total_seconds()
+        iperf_relative_times = {direction: (iperf3_dataframe.index - iperf_start).total_seconds() for direction, iperf3_dataframe in iperf3_direction_dataframes.items()}
         radio_relative_time = (radio_filtered.index - iperf_start).total_seconds()
 
+        if server_radio_dataframe is not None:
+            server_radio_filtered = server_radio_dataframe[(server_radio_dataframe.index >= iperf_start) & (server_radio_dataframe.index <= iperf_end)]
+            server_radio_relative_time = (server_radio_filtered.index - iperf_start).total_seconds()
+
         fig0, fig0_ax1 = plt.subplots(figsize=(10, 6))
 
         fig0_ax1.set_xlabel('Time (seconds)')
         fig0_ax1.set_ylabel('Throughput (kbps)', color='tab:orange')
-        fig0_ax1.plot(iperf_relative_time, iperf3_dataframe['kbps'], color='tab:orange', label='Throughput')
+        for direction, iperf3_dataframe in iperf3_direction_dataframes.items():
+            fig0_ax1.plot(iperf_relative_times[direction], iperf3_dataframe['kbps'], color=DIRECTION_COLORS[direction], label=f'{direction} Throughput')
+        if len(iperf3_direction_dataframes) > 1:
+            fig0_ax1.legend(loc='upper left')
         fig0_ax1.tick_params(axis='y', labelcolor='tab:orange')
         fig0_ax1.ticklabel_format(style='plain', axis='y', useOffset=False)
         fig0_ax1.grid(True, linestyle='--', alpha=0.5)
@@ -78,6 +117,9 @@ for type in INPUT_DATA_FILE_NAME:
         fig0_ax2 = fig0_ax1.twinx()
         fig0_ax2.set_ylabel('RSSI (dBm)', color='tab:blue')
         fig0_ax2.plot(radio_relative_time, radio_filtered['signal'], color='tab:blue', alpha=0.7, label='RSSI')
+        if server_radio_dataframe is not None:
+            fig0_ax2.plot(server_radio_relative_time, server_radio_filtered['signal'], color='tab:purple', alpha=0.7, label='Server RSSI')
+            fig0_ax2.legend(loc='upper right')
         fig0_ax2.tick_params(axis='y', labelcolor='tab:blue')
 
         plt.title(f'Throughput vs Signal Strength - {type} - Test {i}')
@@ -90,7 +132,10 @@ for type in INPUT_DATA_FILE_NAME:
 
         fig1_ax1.set_xlabel('Time (seconds)')
         fig1_ax1.set_ylabel('Throughput (kbps)', color='tab:orange')
-        fig1_ax1.plot(iperf_relative_time, iperf3_dataframe['kbps'], color='tab:orange', label='Throughput')
+        for direction, iperf3_dataframe in iperf3_direction_dataframes.items():
+            fig1_ax1.plot(iperf_relative_times[direction], iperf3_dataframe['kbps'], color=DIRECTION_COLORS[direction], label=f'{direction} Throughput')
+        if len(iperf3_direction_dataframes) > 1:
+            fig1_ax1.legend(loc='upper left')
         fig1_ax1.tick_params(axis='y', labelcolor='tab:orange')
         fig1_ax1.ticklabel_format(style='plain', axis='y', useOffset=False)
         fig1_ax1.grid(True, linestyle='--', alpha=0.5)
@@ -146,4 +191,21 @@ for type in INPUT_DATA_FILE_NAME:
         plt.title(f'RSSI vs MCS and Short GI - {type} - Test {i}')
         fig2.tight_layout()
         plt.savefig(f'{output_dir}/rssi_vs_mcs_sgi_{type}_{i}.png')
-        plt.close(fig2)
\ No newline at end of file
+        plt.close(fig2)
+
+        # Per-stream throughput, only useful when more than one stream was running.
+        if len(iperf3_stream_dataframes) > 1:
+            fig3, fig3_ax1 = plt.subplots(figsize=(10, 6))
+
+            fig3_ax1.set_xlabel('Time (seconds)')
+            fig3_ax1.set_ylabel('Throughput (kbps)')
+            for (socket, direction), iperf3_dataframe in iperf3_stream_dataframes.items():
+                fig3_ax1.plot((iperf3_dataframe.index - iperf_start).total_seconds(), iperf3_dataframe['kbps'], label=f'{direction} Stream {socket}')
+            fig3_ax1.ticklabel_format(style='plain', axis='y', useOffset=False)
+            fig3_ax1.grid(True, linestyle='--', alpha=0.5)
+            fig3_ax1.legend(loc='upper right')
+
+            plt.title(f'Per-Stream Throughput - {type} - Test {i}')
+            fig3.tight_layout()
+            plt.savefig(f'{output_dir}/throughput_per_stream_{type}_{i}.png')
+            plt.close(fig3)
\ No newline at end of file
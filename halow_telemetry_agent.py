@@ -0,0 +1,171 @@
+import sys
+import time
+import json
+import socket
+import argparse
+import threading
+import ipaddress
+import requests
+from typing import TextIO
+
+from halow_tester import (
+    BOARD_NAMES,
+    RADIO_NAMES,
+    USERNAMES,
+    SERVER_AGENT_PORT,
+    SERVER_AGENT_TIMEOUT_SEC,
+    UBUS_REPORT_RATE,
+    request_session_token,
+    get_session_token,
+    get_device,
+    format_peer_stats
+)
+
+# A stop has to wait for the sample in progress, and possibly a login with every credential, before it can reply.
+# Each request can use the timeout for both connecting and reading, so keep the worst case within half of the
+# tester's read timeout.
+AGENT_UBUS_TIMEOUT_SEC = SERVER_AGENT_TIMEOUT_SEC / (4 * (1 + len(USERNAMES)))
+
+# rpcd answers with this JSON-RPC error, or a permission denied status, once a session has expired.
+UBUS_ACCESS_DENIED_ERROR = -32002
+UBUS_STATUS_PERMISSION_DENIED = 6
+
+def sample_peer_stats(ubus_url: str, session_token: str, radio_name: str, id_counter: int) -> tuple:
+    peer_status_request = {
+        'jsonrpc': '2.0',
+        'id': id_counter,
+        'method': 'call',
+        'params': [
+            session_token,
+            'iwinfo',
+            'assoclist',
+            {'device': radio_name}
+        ]
+    }
+
+    # Only a single attempt is made so a slow radio cannot hold up a stop request.
+    peer_status_response = requests.post(ubus_url, json=peer_status_request, timeout=AGENT_UBUS_TIMEOUT_SEC).json()
+
+    if peer_status_response.get('error', {}).get('code') == UBUS_ACCESS_DENIED_ERROR or peer_status_response.get('result', [0])[0] == UBUS_STATUS_PERMISSION_DENIED:
+        raise PermissionError('OpenWRT UBUS session expired')
+
+    if 'result' not in peer_status_response or peer_status_response['result'][0] != 0 or not peer_status_response['result'][1]['results']:
+        raise ValueError('Invalid response from OpenWRT UBUS')
+
+    return format_peer_stats(peer_status_response['result'][1]['results'][0])
+
+def sampling_loop(ubus_session: dict, report_rate: float, sample_log: dict, stop_event: threading.Event) -> None:
+    id_counter = 1
+    while not stop_event.is_set():
+        start_time = time.time()
+
+        try:
+            sample_log['samples'].append(sample_peer_stats(ubus_session['url'], ubus_session['token'], ubus_session['radio_name'], id_counter := id_counter + 1))
+        except PermissionError:
+            # rpcd drops sessions that sit idle for a few minutes, so log in again for the following samples.
+            sample_log['failed_samples'] += 1
+            session_token = request_session_token(ubus_session['url'], id_counter := id_counter + 1, AGENT_UBUS_TIMEOUT_SEC)
+            if session_token is not None:
+                ubus_session['token'] = session_token
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError):
+            sample_log['failed_samples'] += 1
+
+        delta_time = time.time() - start_time
+        stop_event.wait(max(0, report_rate - delta_time))
+
+def _write_response(agent_file: TextIO, response: dict) -> None:
+    agent_file.write(json.dumps(response, separators=(',', ':')) + '\n')
+    agent_file.flush()
+
+def handle_client(connection: socket.socket, ubus_session: dict, default_report_rate: float) -> None:
+    sample_log = {'samples': [], 'failed_samples': 0}
+    stop_event = threading.Event()
+    sampler = None
+
+    try:
+        with connection, connection.makefile('rw') as agent_file:
+            for line in agent_file:
+                try:
+                    request = json.loads(line)
+                    command = request['command']
+                except (ValueError, KeyError, TypeError):
+                    _write_response(agent_file, {'error': 'Malformed request'})
+                    continue
+
+                if command == 'sync':
+                    _write_response(agent_file, {'time_ns': time.time_ns()})
+                elif command == 'start':
+                    # The tester sends its own sample rate so both ends of the link are logged alike.
+                    report_rate = request.get('report_rate', default_report_rate)
+                    if isinstance(report_rate, bool) or not isinstance(report_rate, (int, float)) or report_rate <= 0:
+                        _write_response(agent_file, {'error': 'Invalid report rate'})
+                        continue
+
+                    if sampler is not None:
+                        stop_event.set()
+                        sampler.join()
+
+                    sample_log = {'samples': [], 'failed_samples': 0}
+                    stop_event = threading.Event()
+                    sampler = threading.Thread(target=sampling_loop, args=(ubus_session, report_rate, sample_log, stop_event), daemon=True)
+                    sampler.start()
+
+                    _write_response(agent_file, {'status': 'ok'})
+                elif command == 'stop':
+                    if sampler is not None:
+                        stop_event.set()
+                        sampler.join()
+                        sampler = None
+
+                    _write_response(agent_file, sample_log)
+                else:
+                    _write_response(agent_file, {'error': f'Unknown command \'{command}\''})
+    finally:
+        # The tester may drop the connection while sampling, for example after a read timeout.
+        if sampler is not None:
+            stop_event.set()
+            sampler.join()
+
+def main() -> None:
+    parser = argparse.ArgumentParser('Halow Telemetry Agent', description='Samples the server-side HaLow radio locally and ships the results to the tester.')
+    parser.add_argument('radio_ip_addr', type=str, help='IPV4 address of the server-side HaLow radio.')
+    parser.add_argument('-p', '--port', type=int, default=SERVER_AGENT_PORT)
+    parser.add_argument('-r', '--report-rate', type=float, default=UBUS_REPORT_RATE, help='Sample rate used when the tester does not send one.')
+
+    args = parser.parse_args()
+
+    try:
+        if not isinstance(ipaddress.ip_address(args.radio_ip_addr), ipaddress.IPv4Address):
+            raise ValueError
+    except ValueError:
+        print('Error: Provided IP address is not a valid IPV4 address. Terminating.')
+        sys.exit(-1)
+
+    if args.report_rate <= 0:
+        print('Error: Report rate must be greater than zero. Terminating.')
+        sys.exit(-1)
+
+    # The session is created once and reused for every test the client requests.
+    ubus_url = f'http://{args.radio_ip_addr}/ubus'
+    session_token = get_session_token(ubus_url, 0)
+    device = get_device(ubus_url, session_token, 1)
+
+    if device not in BOARD_NAMES:
+        print(f'Error: Unsupported board \'{device}\'. Terminating.')
+        sys.exit(-1)
+
+    ubus_session = {'url': ubus_url, 'token': session_token, 'radio_name': RADIO_NAMES[BOARD_NAMES.index(device)]}
+
+    with socket.create_server(('', args.port)) as server:
+        print(f'Listening for tester on port {args.port} (Radio: {device})')
+        while True:
+            connection, address = server.accept()
+            print(f'Tester connected from {address[0]}')
+            try:
+                handle_client(connection, ubus_session, args.report_rate)
+            except OSError:
+                pass
+            print(f'Tester disconnected from {address[0]}')
+
+if __name__ == '__main__':
+    main()
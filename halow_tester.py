@@ -4,11 +4,16 @@ import sys
 import time
 import json
 import math
+import socket
+import argparse
+import itertools
+import ipaddress
 import requests
 import datetime
+import threading
 import subprocess
-from statistics import mean
-from typing import Optional
+from statistics import mean, stdev
+from typing import Iterator, Optional, TextIO
 
 CLIENT_HALOW_IP = '169.254.1.1'
 SERVER_HALOW_IP = '169.254.90.55'
@@ -21,12 +26,27 @@ USERNAMES = ['root', 'admin']
 PASSWORDS = ['heltec.org', 'admin']
 
 UBUS_RETRY_LIMIT = 5
+UBUS_TIMEOUT_SEC = 2
 UBUS_REPORT_RATE = 0.1
 
+SERVER_AGENT_ENABLED = True
+SERVER_AGENT_PORT = 5202
+SERVER_AGENT_TIMEOUT_SEC = 5
+SERVER_AGENT_SYNC_ROUNDS = 8
+
+IPERF3_DIRECTION_ARGUMENTS = {
+    'Uplink': [],
+    'Downlink': ['-R'],
+    'Bidir': ['--bidir']
+}
+
+# Each mode is a (direction, parallel stream count) pair run as its own set of tests.
+IPERF3_TCP_TEST_MODES = [('Uplink', 1), ('Downlink', 1), ('Bidir', 1), ('Uplink', 4)]
 IPERF3_TCP_TEST_COUNT = 6
 IPERF3_TCP_TEST_DURATION_SEC = 30
 IPERF3_TCP_TEST_WINDOWS = [[75, 75, 100, 100], [32, 28, 22]]
 
+IPERF3_UDP_TEST_MODES = [('Uplink', 1), ('Downlink', 1), ('Bidir', 1)]
 IPERF3_UDP_TEST_COUNT = 6
 IPERF3_UDP_TEST_DURATION_SEC = 30
 IPERF3_UDP_TEST_THROUGHPUTS = [[2.28, 5.3, 11.4, 14.8], [1.6, 2.8, 4.0]]
@@ -34,6 +54,57 @@ IPERF3_UDP_TEST_THROUGHPUTS = [[2.28, 5.3, 11.4, 14.8], [1.6, 2.8, 4.0]]
 ICMP_PING_TEST_SAMPLES = 110
 ICMP_PING_TEST_BATCH_SIZE = 10
 
+# iperf3 refuses report intervals outside this range and rates that do not match this pattern.
+IPERF3_MIN_REPORT_RATE = 0.1
+IPERF3_MAX_REPORT_RATE = 60
+IPERF3_RATE_PATTERN = r'(\d+(?:\.\d+)?)([KMGkmg]?)'
+IPERF3_RATE_EXPONENTS = {'': 0, 'K': 1, 'M': 2, 'G': 3}
+IPERF3_MAX_PARALLEL_STREAMS = 128
+
+TEST_PHASE_FAILURE_LIMIT = 10
+TEST_PHASE_MIN_COUNT = 2
+
+# Test plan settings and the module-level defaults they override.
+TEST_PLAN_SETTINGS = {
+    'client_ip': 'CLIENT_HALOW_IP',
+    'server_ip': 'SERVER_HALOW_IP',
+    'board_names': 'BOARD_NAMES',
+    'radio_names': 'RADIO_NAMES',
+    'usernames': 'USERNAMES',
+    'passwords': 'PASSWORDS',
+    'ubus_retry_limit': 'UBUS_RETRY_LIMIT',
+    'ubus_report_rate': 'UBUS_REPORT_RATE',
+    'server_agent_enabled': 'SERVER_AGENT_ENABLED',
+    'server_agent_port': 'SERVER_AGENT_PORT',
+    'iperf3_tcp_windows': 'IPERF3_TCP_TEST_WINDOWS',
+    'iperf3_udp_throughputs': 'IPERF3_UDP_TEST_THROUGHPUTS'
+}
+
+_TEST_PLAN_COMMON_FIELDS = {
+    'type': str,
+    'name': str,
+    'target': str,
+    'report_rate': (int, float),
+    'max_failures': int,
+    'min_count': int,
+    'stop_cv': (int, float)
+}
+TEST_PLAN_PHASE_FIELDS = {
+    'iperf3': _TEST_PLAN_COMMON_FIELDS | {
+        'protocol': str,
+        'direction': str,
+        'parallel_streams': int,
+        'count': int,
+        'duration_sec': int,
+        'bitrate': str,
+        'window': str
+    },
+    'ping': _TEST_PLAN_COMMON_FIELDS | {
+        'samples': int,
+        'batch_size': int
+    }
+}
+
 NRC_TO_HALOW_CHANNEL = {
     # 1 MHz Bandwidth Channels
     1: 1,    # 902.5 MHz
@@ -142,8 +213,7 @@ def make_timestamp() -> str:
     curr_datetime = str(datetime.datetime.now()).split()
     return f'{curr_datetime[0]}_{curr_datetime[1][:8]}'
 
-def get_session_token(id_counter: int) -> str:
-    authentication_response = None
+def request_session_token(ubus_url: str, id_counter: int, timeout: float = UBUS_TIMEOUT_SEC) -> Optional[str]:
     for i in range(len(USERNAMES)):
         authentication_payload = {
             'jsonrpc': '2.0',
@@ -158,21 +228,23 @@ def get_session_token(id_counter: int) -> str:
         }
 
         try:
-            authentication_response = requests.post(UBUS_JSONRPC_URL, json=authentication_payload).json()
-        except:
-            print('ERROR: Failed to retrieve OpenWRT UBUS authentication token. Terminating.')
-            sys.exit(-1)
+            authentication_response = requests.post(ubus_url, json=authentication_payload, timeout=timeout).json()
+            if authentication_response['result'][0] == 0:
+                return authentication_response['result'][1]['ubus_rpc_session']
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError):
+            continue
 
-        if authentication_response['result'][0] == 0:
-            break
+    return None
 
-    if authentication_response is None:
+def get_session_token(ubus_url: str, id_counter: int) -> str:
+    session_token = request_session_token(ubus_url, id_counter)
+    if session_token is None:
         print('ERROR: Failed to retrieve OpenWRT UBUS authentication token. Terminating.')
         sys.exit(-1)
 
-    return authentication_response['result'][1]['ubus_rpc_session']
+    return session_token
 
-def get_device(session_token: str, id_counter: int) -> str:
+def get_device(ubus_url: str, session_token: str, id_counter: int) -> str:
     get_devices_request = {
         'jsonrpc': '2.0',
         'id': id_counter,
@@ -189,7 +261,10 @@ def get_device(session_token: str, id_counter: int) -> str:
     peer_status_response = None
     while retry_counter < UBUS_RETRY_LIMIT:
         retry_counter += 1
-        peer_status_response = requests.post(UBUS_JSONRPC_URL, json=get_devices_request).json()
+        try:
+            peer_status_response = requests.post(ubus_url, json=get_devices_request, timeout=UBUS_TIMEOUT_SEC).json()
+        except requests.RequestException:
+            continue
         if peer_status_response['result'][0] == 0 and peer_status_response['result'][1]['board_name']:
             break
         
@@ -198,7 +273,7 @@ def get_device(session_token: str, id_counter: int) -> str:
 
     return peer_status_response['result'][1]['board_name']
 
-def _get_peer_stats_raw(session_token: str, device: str, id_counter: int) -> dict:
+def _get_peer_stats_raw(ubus_url: str, session_token: str, device: str, id_counter: int) -> dict:
     peer_status_request = {
         'jsonrpc': '2.0',
         'id': id_counter,
@@ -217,7 +292,10 @@ def _get_peer_stats_raw(session_token: str, device: str, id_counter: int) -> dic
     peer_status_response = None
     while retry_counter < UBUS_RETRY_LIMIT:
         retry_counter += 1
-        peer_status_response = requests.post(UBUS_JSONRPC_URL, json=peer_status_request).json()
+        try:
+            peer_status_response = requests.post(ubus_url, json=peer_status_request, timeout=UBUS_TIMEOUT_SEC).json()
+        except requests.RequestException:
+            continue
         if peer_status_response['result'][0] == 0 and peer_status_response['result'][1]['results'] and (peer_status_response['result'][1]['results'][0]['noise'] != 0 if device == BOARD_NAMES[0] else True):
             break
 
@@ -228,7 +306,7 @@ def _get_peer_stats_raw(session_token: str, device: str, id_counter: int) -> dic
 
     return peer_status_response['result'][1]['results'][0]
         
-def get_channel_and_txpower(session_token: str, device: str, id_counter: int) -> tuple[int, int]:
+def get_channel_and_txpower(ubus_url: str, session_token: str, device: str, id_counter: int) -> tuple[int, int]:
     device_info_request = {
         'jsonrpc': '2.0',
         'id': id_counter,
@@ -243,7 +321,7 @@ def get_channel_and_txpower(session_token: str, device: str, id_counter: int) ->
 
     device_info_response = None
     try:
-        device_info_response = requests.post(UBUS_JSONRPC_URL, json=device_info_request).json()
+        device_info_response = requests.post(ubus_url, json=device_info_request, timeout=UBUS_TIMEOUT_SEC).json()
     except:
         print('ERROR: Failed to query channel from OpenWRT UBUS. Terminating.')
         sys.exit(-1)
@@ -257,9 +335,7 @@ def get_channel_and_txpower(session_token: str, device: str, id_counter: int) ->
     else:
         return (NRC_TO_HALOW_CHANNEL[device_info_response['result'][1]['channel']], device_info_response['result'][1]['txpower'])
 
-def get_peer_stats(session_token: str, device: str, id_counter: int) -> tuple:
-    peer_stats_raw = _get_peer_stats_raw(session_token, device, id_counter)
-    
+def format_peer_stats(peer_stats_raw: dict) -> tuple:
     return (
         time.time_ns(),
         peer_stats_raw['signal'],
@@ -271,208 +347,637 @@ def get_peer_stats(session_token: str, device: str, id_counter: int) -> tuple:
         peer_stats_raw['tx']['short_gi'] if 'short_gi' in peer_stats_raw['tx'] else -1
     )
 
-def get_iperf3_throughput(bandwidth: int, device: str) -> str:
-    return f'{IPERF3_UDP_TEST_THROUGHPUTS[BOARD_NAMES.index(device)][int(math.log(bandwidth, 2))]}M'
+def get_peer_stats(ubus_url: str, session_token: str, device: str, id_counter: int) -> tuple:
+    return format_peer_stats(_get_peer_stats_raw(ubus_url, session_token, device, id_counter))
+
+def connect_server_agent() -> Optional[TextIO]:
+    if not SERVER_AGENT_ENABLED:
+        return None
+
+    try:
+        sock = socket.create_connection((SERVER_HALOW_IP, SERVER_AGENT_PORT), timeout=SERVER_AGENT_TIMEOUT_SEC)
+    except OSError:
+        print('WARNING: Failed to connect to server telemetry agent. Continuing without server-side telemetry.')
+        return None
+
+    # The file object keeps the underlying socket open until it is closed.
+    server_agent = sock.makefile('rw')
+    sock.close()
+
+    return server_agent
+
+def _server_agent_request(server_agent: TextIO, command: str, **parameters) -> dict:
+    server_agent.write(json.dumps({'command': command} | parameters) + '\n')
+    server_agent.flush()
+
+    response = server_agent.readline()
+    if not response:
+        raise OSError('Server telemetry agent closed the connection')
+
+    response = json.loads(response)
+    if 'error' in response:
+        raise ValueError(response['error'])
+
+    return response
+
+def _get_server_clock_offset(server_agent: TextIO) -> int:
+    # Estimate the server clock offset from the exchange with the lowest round trip time.
+    best_round_trip = None
+    clock_offset = 0
+    for _ in range(SERVER_AGENT_SYNC_ROUNDS):
+        send_time = time.time_ns()
+        server_time = _server_agent_request(server_agent, 'sync')['time_ns']
+        receive_time = time.time_ns()
+
+        if best_round_trip is None or receive_time - send_time < best_round_trip:
+            best_round_trip = receive_time - send_time
+            clock_offset = server_time - (send_time + receive_time) // 2
+
+    return clock_offset
+
+def _reconnect_server_agent(server_agent: TextIO) -> Optional[TextIO]:
+    # A socket file is unusable after a timeout, and a late reply would be read as the answer to the next request.
+    try:
+        server_agent.close()
+    except OSError:
+        pass
+
+    print('\033[2KWARNING: Lost connection to server telemetry agent. Reconnecting.')
+    return connect_server_agent()
+
+def start_server_telemetry(server_agent: Optional[TextIO], report_rate: float) -> tuple[Optional[TextIO], int]:
+    if server_agent is None:
+        return (None, 0)
+
+    try:
+        clock_offset = _get_server_clock_offset(server_agent)
+        # The agent samples at the same rate as the client so both logs stay aligned.
+        _server_agent_request(server_agent, 'start', report_rate=report_rate)
+    except (OSError, ValueError, KeyError):
+        print('\033[2KWARNING: Failed to start server-side telemetry.')
+        return (_reconnect_server_agent(server_agent), 0)
+
+    return (server_agent, clock_offset)
+
+def stop_server_telemetry(server_agent: Optional[TextIO], clock_offset: int) -> tuple[Optional[TextIO], list]:
+    if server_agent is None:
+        return (None, [])
+
+    try:
+        response = _server_agent_request(server_agent, 'stop')
+        samples = response['samples']
+    except (OSError, ValueError, KeyError):
+        print('\033[2KWARNING: Failed to retrieve server-side telemetry.')
+        return (_reconnect_server_agent(server_agent), [])
+
+    failed_samples = response.get('failed_samples', 0)
+    if not samples or failed_samples:
+        print(f'\033[2KWARNING: Server telemetry agent returned {len(samples)} samples ({failed_samples} failed).')
+
+    # Shift server timestamps onto the local clock so they line up with the client samples.
+    return (server_agent, [(sample[0] - clock_offset, *sample[1:]) for sample in samples])
+
+def parse_iperf3_rate(rate: str, base: int) -> float:
+    # iperf3 scales bitrates by powers of 1000 and window sizes by powers of 1024.
+    match = re.fullmatch(IPERF3_RATE_PATTERN, rate)
+    return float(match.group(1)) * base ** IPERF3_RATE_EXPONENTS[match.group(2).upper()]
+
+def split_iperf3_bitrate(bitrate: str, parallel_streams: int) -> str:
+    # iperf3 applies the target bitrate to every stream, so split the total across them.
+    # Whole bits per second are passed since iperf3 truncates the rate and treats zero as unlimited.
+    return str(int(parse_iperf3_rate(bitrate, 1000) / parallel_streams))
+
+def get_iperf3_throughput(bandwidth: int, device: str, parallel_streams: int) -> str:
+    return split_iperf3_bitrate(f'{IPERF3_UDP_TEST_THROUGHPUTS[BOARD_NAMES.index(device)][int(math.log(bandwidth, 2))]}M', parallel_streams)
 
 def get_iperf3_windows(bandwidth: int, device: str) -> str:
     return f'{IPERF3_TCP_TEST_WINDOWS[BOARD_NAMES.index(device)][int(math.log(bandwidth, 2))]}K'
 
+def make_iperf3_test_name(protocol: str, direction: str, parallel_streams: int) -> str:
+    # Single stream uplink tests keep the original naming so older results remain comparable.
+    if direction == 'Uplink' and parallel_streams == 1:
+        return protocol
+
+    return f'{protocol}_{direction}' + (f'_P{parallel_streams}' if parallel_streams > 1 else '')
+
+def _get_iperf3_stream_direction(stream: dict) -> str:
+    stream_stats = stream['udp'] if 'udp' in stream else stream['sender']
+    return 'Uplink' if stream_stats['sender'] else 'Downlink'
+
+def summarize_iperf3_results(results_json: dict) -> tuple[dict, list]:
+    test_start = results_json['start']['test_start']
+    results_end = results_json['end']
+
+    direction_sums = {}
+    if test_start.get('bidir', 0):
+        direction_sums['Uplink'] = results_end['sum_received']
+        direction_sums['Downlink'] = results_end['sum_received_bidir_reverse']
+    elif test_start.get('reverse', 0):
+        direction_sums['Downlink'] = results_end['sum_received']
+    else:
+        direction_sums['Uplink'] = results_end['sum_received']
+
+    stream_stats = []
+    for stream in results_end['streams']:
+        direction = _get_iperf3_stream_direction(stream)
+        if 'udp' in stream:
+            # The UDP summary counts what was sent, so scale it by the loss to get what was delivered.
+            delivered_fraction = 1 - stream['udp']['lost_percent'] / 100.0
+            stream_stats.append((
+                stream['udp']['socket'],
+                direction,
+                stream['udp']['bits_per_second'] * delivered_fraction,
+                int(stream['udp']['bytes'] * delivered_fraction),
+                -1,
+                -1,
+                stream['udp']['jitter_ms'],
+                stream['udp']['lost_percent']
+            ))
+        else:
+            stream_stats.append((
+                stream['receiver']['socket'],
+                direction,
+                stream['receiver']['bits_per_second'],
+                stream['receiver']['bytes'],
+                stream['sender'].get('retransmits', -1),
+                stream['sender'].get('mean_rtt', -1),
+                -1,
+                -1
+            ))
+
+    # RTT is only reported by the sending side, so reverse direction streams may not have one.
+    direction_summaries = {}
+    for direction, direction_sum in direction_sums.items():
+        rtts = [entry[5] for entry in stream_stats if entry[1] == direction and entry[5] > 0]
+        direction_summaries[direction] = (direction_sum['bits_per_second'] / 1000.0, mean(rtts) / 1000.0 if rtts else None)
+
+    return (direction_summaries, stream_stats)
+
 def _write_out_stat_log_csv(path: str, stat_log: list) -> None:
     with open(f'{path}.csv', 'w') as file:
         file.write('timestamp,signal,signal_avg,noise_floor,rx_mcs,rx_short_gi,tx_mcs,tx_short_gi\n')
         for entry in stat_log:
             file.write(f'{entry[0]},{entry[1]},{entry[2]},{entry[3]},{entry[4]},{entry[5]},{entry[6]},{entry[7]}\n')
 
-def write_out_iperf3_result_files(path: str, iperf3_results: str, stat_log: list) -> None:
+def _write_out_stream_stats_csv(path: str, stream_stats: list) -> None:
+    with open(f'{path}_Streams.csv', 'w') as file:
+        file.write('socket,direction,bits_per_second,bytes,retransmits,mean_rtt,jitter_ms,lost_percent\n')
+        for entry in stream_stats:
+            file.write(f'{entry[0]},{entry[1]},{entry[2]},{entry[3]},{entry[4]},{entry[5]},{entry[6]},{entry[7]}\n')
+
+def write_out_iperf3_result_files(path: str, iperf3_results: str, stat_log: list, server_stat_log: list, stream_stats: list) -> None:
     with open(f'{path}.json', 'w') as file:
         file.write(iperf3_results)
+    _write_out_stream_stats_csv(path, stream_stats)
     _write_out_stat_log_csv(path, stat_log)
+    if server_stat_log:
+        _write_out_stat_log_csv(f'{path}_Server', server_stat_log)
     
-def write_out_ping_result_files(path: str, ping_stats: list, stat_log: list) -> None:
+def write_out_ping_result_files(path: str, ping_stats: list, stat_log: list, server_stat_log: list) -> None:
     with open(f'{path}_Pings.csv', 'w') as file:
         file.write('timestamp,bytes,sequence,ttl,time_ms\n')
         for entry in ping_stats:
             file.write(f'{entry[0]},{entry[1]},{entry[2]},{entry[3]},{entry[4]}\n')
         _write_out_stat_log_csv(path, stat_log)
+        if server_stat_log:
+            _write_out_stat_log_csv(f'{path}_Server', server_stat_log)
 
 def parse_ping_line(line: str) -> Optional[tuple]:
     match = re.search(r'\[(\d+\.\d+)\].*?(\d+) bytes.*?icmp_seq=(\d+).*?ttl=(\d+).*?time=([\d.]+)', line)
     return (match.group(1), match.group(2), match.group(3), match.group(4), match.group(5)) if match is not None else None
 
-def main() -> None:
-    session_token = get_session_token(0)
+def make_default_test_plan() -> dict:
+    phases = []
+    for direction, parallel_streams in IPERF3_UDP_TEST_MODES:
+        phases.append({'type': 'iperf3', 'protocol': 'UDP', 'direction': direction, 'parallel_streams': parallel_streams})
+    for direction, parallel_streams in IPERF3_TCP_TEST_MODES:
+        phases.append({'type': 'iperf3', 'protocol': 'TCP', 'direction': direction, 'parallel_streams': parallel_streams})
+    phases.append({'type': 'ping'})
 
-    id_counter = 0
-    device = get_device(session_token, id_counter := id_counter + 1)
-    channel, txpower = get_channel_and_txpower(session_token, device, id_counter := id_counter + 1)
-    bandwidth = CHANNEL_TO_BANDWIDTH[channel]
-    
-    directory = f'./results/{make_timestamp()}_{bandwidth}MHz_CH{channel}_{txpower}dBM_halow_test'
+    return {'settings': {}, 'phases': phases}
 
-    os.mkdir(directory)
+def load_test_plan(path: str) -> dict:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        print(f'ERROR: Failed to read test plan \'{path}\'. Terminating.')
+        sys.exit(-1)
 
-    # Perform UDP testing.
-    iperf3_udp_parameters = [
-        'iperf3', '-J', '-u',
-        '-c', SERVER_HALOW_IP,
-        '-t', str(IPERF3_UDP_TEST_DURATION_SEC),
-        '-b', get_iperf3_throughput(bandwidth, device),
-        '-i', str(UBUS_REPORT_RATE)
-    ]
+def _is_valid_test_plan_value(value, value_type) -> bool:
+    # bool is a subclass of int, so it has to be rejected explicitly for numeric fields.
+    if isinstance(value, bool) and value_type is not bool:
+        return False
 
-    i = 0
-    previous_udp_bitrates = []
-    previous_udp_bitrate = 'N/A'
-    while i < IPERF3_UDP_TEST_COUNT:
-        iperf3_tcp_process = subprocess.Popen(iperf3_udp_parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, pipesize=1024**2)
-
-        stat_log = []
-        spinner_index = 0
-        while iperf3_tcp_process.poll() == None:
-            start_time = time.time()
-
-            stat_log.append(get_peer_stats(session_token, device, id_counter := id_counter + 1))
-            rssi = stat_log[-1][1]
-            noise = stat_log[-1][3]
-            snr = rssi - noise
-
-            if device != BOARD_NAMES[1]:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Performing UDP test [{i + 1}/{IPERF3_TCP_TEST_COUNT}] (RSSI: {rssi}dBm, Noise Floor: {noise}dBm, SNR: {snr}dB, Previous Bitrate: {previous_udp_bitrate})', end='\033[?7h\r')
-            else:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Performing UDP test [{i + 1}/{IPERF3_TCP_TEST_COUNT}] (RSSI: {rssi}dBm, Previous Bitrate: {previous_udp_bitrate})', end='\033[?7h\r')
-            spinner_index = (spinner_index + 1) % len(PROGRESS_SPIN)
+    return isinstance(value, value_type)
 
-            delta_time = time.time() - start_time
-            time.sleep(max(0, UBUS_REPORT_RATE - delta_time))
+def _is_valid_ipv4_address(value: str) -> bool:
+    try:
+        return isinstance(ipaddress.ip_address(value), ipaddress.IPv4Address)
+    except ValueError:
+        return False
+
+def _is_valid_report_rate(value: float) -> bool:
+    return IPERF3_MIN_REPORT_RATE <= value <= IPERF3_MAX_REPORT_RATE
+
+def _get_phase_name(phase: dict) -> str:
+    if 'name' in phase:
+        return phase['name']
+
+    if phase['type'] == 'ping':
+        return 'ICMP'
+
+    return make_iperf3_test_name(phase.get('protocol', ''), phase.get('direction', 'Uplink'), phase.get('parallel_streams', 1))
+
+def _validate_test_plan_phase(index: int, phase) -> list[str]:
+    prefix = f'Phase {index + 1}'
+    if not isinstance(phase, dict):
+        return [f'{prefix}: Must be an object.']
+
+    if phase.get('type') not in TEST_PLAN_PHASE_FIELDS:
+        return [f'{prefix}: Unknown phase type \'{phase.get("type")}\'.']
+
+    errors = []
+    phase_fields = TEST_PLAN_PHASE_FIELDS[phase['type']]
+    for key, value in phase.items():
+        if key not in phase_fields:
+            errors.append(f'{prefix}: Unknown field \'{key}\'.')
+        elif not _is_valid_test_plan_value(value, phase_fields[key]):
+            errors.append(f'{prefix}: Field \'{key}\' has an invalid type.')
+        elif key in ('count', 'min_count', 'stop_cv', 'parallel_streams', 'duration_sec', 'samples', 'batch_size') and value <= 0:
+            errors.append(f'{prefix}: Field \'{key}\' must be greater than zero.')
+        elif key == 'max_failures' and value < 0:
+            errors.append(f'{prefix}: Field \'{key}\' must not be negative.')
+        elif key == 'report_rate' and not _is_valid_report_rate(value):
+            errors.append(f'{prefix}: Field \'{key}\' must be between {IPERF3_MIN_REPORT_RATE} and {IPERF3_MAX_REPORT_RATE} seconds.')
+        elif key in ('bitrate', 'window') and not re.fullmatch(IPERF3_RATE_PATTERN, value):
+            errors.append(f'{prefix}: Field \'{key}\' must be a number with an optional K, M or G suffix.')
+        elif key == 'window' and parse_iperf3_rate(value, 1024) < 1:
+            errors.append(f'{prefix}: Field \'{key}\' must be at least one byte.')
+        elif key == 'parallel_streams' and value > IPERF3_MAX_PARALLEL_STREAMS:
+            errors.append(f'{prefix}: Field \'{key}\' must not be greater than {IPERF3_MAX_PARALLEL_STREAMS}.')
+        elif key == 'target' and not _is_valid_ipv4_address(value):
+            errors.append(f'{prefix}: Field \'{key}\' must be a valid IPV4 address.')
+        elif key == 'name' and (not value or '/' in value or '\\' in value):
+            errors.append(f'{prefix}: Field \'{key}\' must be non-empty and must not contain path separators.')
+
+    if phase['type'] == 'iperf3':
+        if phase.get('protocol') not in ('UDP', 'TCP'):
+            errors.append(f'{prefix}: Field \'protocol\' must be \'UDP\' or \'TCP\'.')
+        if phase.get('direction', 'Uplink') not in IPERF3_DIRECTION_ARGUMENTS:
+            errors.append(f'{prefix}: Field \'direction\' must be one of {", ".join(IPERF3_DIRECTION_ARGUMENTS)}.')
+        if phase.get('protocol') == 'TCP' and 'bitrate' in phase:
+            errors.append(f'{prefix}: Field \'bitrate\' only applies to UDP phases.')
+        if phase.get('protocol') == 'UDP' and 'window' in phase:
+            errors.append(f'{prefix}: Field \'window\' only applies to TCP phases.')
+
+    # The remaining checks combine fields, so they need every field to be valid on its own first.
+    if errors:
+        return errors
+
+    if phase['type'] == 'iperf3':
+        count = phase.get('count', IPERF3_UDP_TEST_COUNT if phase['protocol'] == 'UDP' else IPERF3_TCP_TEST_COUNT)
+        if 'bitrate' in phase and parse_iperf3_rate(phase['bitrate'], 1000) / phase.get('parallel_streams', 1) < 1:
+            errors.append(f'{prefix}: Field \'bitrate\' must be at least one bit per second for every stream.')
+    else:
+        samples = phase.get('samples', ICMP_PING_TEST_SAMPLES)
+        batch_size = phase.get('batch_size', ICMP_PING_TEST_BATCH_SIZE)
+        count = samples // batch_size
+        if samples % batch_size != 0:
+            errors.append(f'{prefix}: Field \'samples\' must be a multiple of \'batch_size\'.')
+
+    if ('min_count' in phase or 'stop_cv' in phase) and phase.get('min_count', TEST_PHASE_MIN_COUNT) > count:
+        errors.append(f'{prefix}: Field \'min_count\' must not be greater than the number of repetitions ({count}).')
+
+    return errors
+
+def _validate_test_plan_settings(settings: dict) -> list[str]:
+    errors = []
+    valid_settings = {}
+    for key, value in settings.items():
+        if key not in TEST_PLAN_SETTINGS:
+            errors.append(f'Settings: Unknown field \'{key}\'.')
+            continue
 
-        if iperf3_tcp_process.returncode != 0:
+        default_value = globals()[TEST_PLAN_SETTINGS[key]]
+        value_type = (int, float) if isinstance(default_value, float) else type(default_value)
+        if not _is_valid_test_plan_value(value, value_type):
+            errors.append(f'Settings: Field \'{key}\' has an invalid type.')
+        elif key in ('client_ip', 'server_ip') and not _is_valid_ipv4_address(value):
+            errors.append(f'Settings: Field \'{key}\' must be a valid IPV4 address.')
+        elif key == 'ubus_report_rate' and not _is_valid_report_rate(value):
+            errors.append(f'Settings: Field \'{key}\' must be between {IPERF3_MIN_REPORT_RATE} and {IPERF3_MAX_REPORT_RATE} seconds.')
+        elif key == 'ubus_retry_limit' and value <= 0:
+            errors.append(f'Settings: Field \'{key}\' must be greater than zero.')
+        elif key == 'server_agent_port' and not 0 < value <= 65535:
+            errors.append(f'Settings: Field \'{key}\' must be a valid port number.')
+        elif key in ('board_names', 'radio_names', 'usernames', 'passwords') and not all(isinstance(entry, str) for entry in value):
+            errors.append(f'Settings: Field \'{key}\' must be a list of strings.')
+        elif key in ('iperf3_tcp_windows', 'iperf3_udp_throughputs') and not all(isinstance(row, list) and row and all(_is_valid_test_plan_value(entry, (int, float)) and entry > 0 for entry in row) for row in value):
+            errors.append(f'Settings: Field \'{key}\' must be a list of non-empty lists of positive numbers.')
+        else:
+            valid_settings[key] = value
+
+    # Lists that are indexed together must line up, whether they come from the plan or the defaults.
+    def get_setting(key: str):
+        return valid_settings.get(key, globals()[TEST_PLAN_SETTINGS[key]])
+
+    for first_key, second_key in (('board_names', 'radio_names'), ('board_names', 'iperf3_tcp_windows'), ('board_names', 'iperf3_udp_throughputs'), ('usernames', 'passwords')):
+        if (first_key in settings or second_key in settings) and len(get_setting(first_key)) != len(get_setting(second_key)):
+            errors.append(f'Settings: Fields \'{first_key}\' and \'{second_key}\' must have the same length.')
+
+    return errors
+
+def validate_test_plan(test_plan) -> list[str]:
+    if not isinstance(test_plan, dict):
+        return ['Test plan must be an object.']
+
+    errors = []
+    for key in test_plan:
+        if key not in ('settings', 'phases'):
+            errors.append(f'Unknown top-level field \'{key}\'.')
+
+    settings = test_plan.get('settings', {})
+    if not isinstance(settings, dict):
+        errors.append('Field \'settings\' must be an object.')
+        settings = {}
+
+    errors += _validate_test_plan_settings(settings)
+
+    phases = test_plan.get('phases')
+    if not isinstance(phases, list) or not phases:
+        errors.append('Field \'phases\' must be a non-empty list.')
+        return errors
+
+    phase_names = set()
+    for index, phase in enumerate(phases):
+        phase_errors = _validate_test_plan_phase(index, phase)
+        errors += phase_errors
+        if phase_errors:
             continue
 
-        iperf3_results = iperf3_tcp_process.communicate()[0]
+        # Phase names are used for the result file names, so they must not collide.
+        phase_name = _get_phase_name(phase)
+        if phase_name in phase_names:
+            errors.append(f'Phase {index + 1}: Duplicate phase name \'{phase_name}\'.')
+        phase_names.add(phase_name)
 
-        # Extract average bitrate from test that had just occured.
-        results_json = json.loads(iperf3_results)
-        previous_udp_bitrates.append(results_json['end']['sum_received']['bits_per_second'] / 1000.0)
-        previous_udp_bitrate = f'{previous_udp_bitrates[-1]:.2f} Kbit/s'
+    return errors
 
-        write_out_iperf3_result_files(f'{directory}/Iperf3_UDP_Test_{i + 1}', iperf3_results, stat_log)
+def apply_test_plan_settings(settings: dict) -> None:
+    global UBUS_JSONRPC_URL
 
-        i += 1
+    for key, value in settings.items():
+        globals()[TEST_PLAN_SETTINGS[key]] = value
 
-    if IPERF3_UDP_TEST_COUNT > 0:
-        print(f'\033[2K✓ UDP Testing Complete (Average Bitrate: {mean(previous_udp_bitrates):.2f} Kbit/s)')
+    UBUS_JSONRPC_URL = f'http://{CLIENT_HALOW_IP}/ubus'
 
-    # Perform TCP testing.
-    iperf3_tcp_parameters = [
-        'iperf3', '-J',
-        '-c', SERVER_HALOW_IP,
-        '-t', str(IPERF3_TCP_TEST_DURATION_SEC),
-        '-w', get_iperf3_windows(bandwidth, device),
-        '-i', str(UBUS_REPORT_RATE)
-    ]
+def compile_test_plan(test_plan: dict, device: str, bandwidth: int) -> list[dict]:
+    schedule = []
+    for phase in test_plan['phases']:
+        report_rate = phase.get('report_rate', UBUS_REPORT_RATE)
+        target = phase.get('target', SERVER_HALOW_IP)
 
-    i = 0
-    previous_tcp_rtt = 'N/A'
-    previous_tcp_bitrate = 'N/A'
-    previous_tcp_rtts = []
-    previous_tcp_bitrates = []
-    while i < IPERF3_TCP_TEST_COUNT:
-        iperf3_tcp_process = subprocess.Popen(iperf3_tcp_parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, pipesize=1024**2)
-
-        stat_log = []
-        spinner_index = 0
-        while iperf3_tcp_process.poll() == None:
-            start_time = time.time()
-
-            stat_log.append(get_peer_stats(session_token, device, id_counter := id_counter + 1))
-            rssi = stat_log[-1][1]
-            noise = stat_log[-1][3]
-            snr = rssi - noise
-
-            if device != BOARD_NAMES[1]:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Performing TCP test [{i + 1}/{IPERF3_TCP_TEST_COUNT}] (RSSI: {rssi}dBm, Noise Floor: {noise}dBm, SNR: {snr}dB, Previous Bitrate: {previous_tcp_bitrate}, Previous Average RTT: {previous_tcp_rtt})', end='\033[?7h\r')
+        step = {
+            'type': phase['type'],
+            'name': _get_phase_name(phase),
+            'report_rate': report_rate,
+            'max_failures': phase.get('max_failures', TEST_PHASE_FAILURE_LIMIT),
+            'min_count': phase.get('min_count', TEST_PHASE_MIN_COUNT),
+            'stop_cv': phase.get('stop_cv')
+        }
+
+        # Device specific defaults are resolved here so every phase can start without further device queries.
+        try:
+            if phase['type'] == 'iperf3':
+                protocol = phase['protocol']
+                parallel_streams = phase.get('parallel_streams', 1)
+                if protocol == 'UDP':
+                    count = phase.get('count', IPERF3_UDP_TEST_COUNT)
+                    duration = phase.get('duration_sec', IPERF3_UDP_TEST_DURATION_SEC)
+                    bitrate = split_iperf3_bitrate(phase['bitrate'], parallel_streams) if 'bitrate' in phase else get_iperf3_throughput(bandwidth, device, parallel_streams)
+                    rate_parameters = ['-u', '-b', bitrate]
+                else:
+                    count = phase.get('count', IPERF3_TCP_TEST_COUNT)
+                    duration = phase.get('duration_sec', IPERF3_TCP_TEST_DURATION_SEC)
+                    rate_parameters = ['-w', phase.get('window', get_iperf3_windows(bandwidth, device))]
+
+                step['protocol'] = protocol
+                step['count'] = count
+                step['command'] = [
+                    'iperf3', '-J',
+                    '-c', target,
+                    '-t', str(duration),
+                    '-P', str(parallel_streams),
+                    '-i', str(report_rate)
+                ] + rate_parameters + IPERF3_DIRECTION_ARGUMENTS[phase.get('direction', 'Uplink')]
             else:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Performing TCP test [{i + 1}/{IPERF3_TCP_TEST_COUNT}] (RSSI: {rssi}dBm, Previous Bitrate: {previous_tcp_bitrate}, Previous Average RTT: {previous_tcp_rtt})', end='\033[?7h\r')
-            spinner_index = (spinner_index + 1) % len(PROGRESS_SPIN)
+                samples = phase.get('samples', ICMP_PING_TEST_SAMPLES)
+                batch_size = phase.get('batch_size', ICMP_PING_TEST_BATCH_SIZE)
+
+                step['samples'] = samples
+                step['batch_size'] = batch_size
+                step['command'] = [
+                    'ping', '-D', '-4',
+                    '-c', str(batch_size),
+                    target
+                ]
+        except (ValueError, IndexError):
+            print(f'ERROR: No default iperf3 rate for \'{step["name"]}\' on {device} at {bandwidth}MHz. Terminating.')
+            sys.exit(-1)
 
-            delta_time = time.time() - start_time
-            time.sleep(max(0, UBUS_REPORT_RATE - delta_time))
+        schedule.append(step)
 
-        if iperf3_tcp_process.returncode != 0:
-            continue
+    return schedule
 
-        iperf3_results = iperf3_tcp_process.communicate()[0]
+def _monitor_process(process: subprocess.Popen, session_token: str, device: str, id_counter: Iterator[int], report_rate: float, status: str, details: str) -> tuple[list, str]:
+    # Drain the output while monitoring, a large iperf3 report would otherwise fill the pipe and stall the process.
+    output = []
+    output_reader = threading.Thread(target=lambda: output.append(process.communicate()[0]), daemon=True)
+    output_reader.start()
 
-        # Extract average bitrate from test that had just occured.
-        results_json = json.loads(iperf3_results)
+    stat_log = []
+    spinner_index = 0
+    while output_reader.is_alive():
+        start_time = time.time()
+
+        stat_log.append(get_peer_stats(UBUS_JSONRPC_URL, session_token, device, next(id_counter)))
+        rssi = stat_log[-1][1]
+        noise = stat_log[-1][3]
+        snr = rssi - noise
+
+        if device != BOARD_NAMES[1]:
+            print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} {status} (RSSI: {rssi}dBm, Noise Floor: {noise}dBm, SNR: {snr}dB, {details})', end='\033[?7h\r')
+        else:
+            print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} {status} (RSSI: {rssi}dBm, {details})', end='\033[?7h\r')
+        spinner_index = (spinner_index + 1) % len(PROGRESS_SPIN)
+
+        delta_time = time.time() - start_time
+        time.sleep(max(0, report_rate - delta_time))
+
+    output_reader.join()
+
+    return (stat_log, output[0])
+
+def _has_failed_too_often(step: dict, failures: int) -> bool:
+    if failures <= step['max_failures']:
+        return False
+
+    print(f'\033[2K✗ {step["name"]} Testing Aborted ({failures} failed attempts)')
+    return True
+
+def _is_phase_stable(step: dict, values: list) -> bool:
+    # Stop repeating once the coefficient of variation drops below the requested threshold.
+    if step['stop_cv'] is None or len(values) < max(step['min_count'], TEST_PHASE_MIN_COUNT) or mean(values) == 0:
+        return False
+
+    return stdev(values) / mean(values) <= step['stop_cv']
+
+def run_iperf3_phase(step: dict, session_token: str, device: str, id_counter: Iterator[int], server_agent: Optional[TextIO], directory: str) -> Optional[TextIO]:
+    is_tcp = step['protocol'] == 'TCP'
+
+    i = 0
+    failures = 0
+    total_bitrates = []
+    previous_bitrates = {}
+    previous_rtts = {}
+    previous_bitrate = 'N/A'
+    previous_rtt = 'N/A'
+    while i < step['count']:
+        details = f'Previous Bitrate: {previous_bitrate}' + (f', Previous Average RTT: {previous_rtt}' if is_tcp else '')
+
+        server_agent, clock_offset = start_server_telemetry(server_agent, step['report_rate'])
+        iperf3_process = subprocess.Popen(step['command'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, pipesize=1024**2)
+        stat_log, iperf3_results = _monitor_process(iperf3_process, session_token, device, id_counter, step['report_rate'], f'Performing {step["name"]} test [{i + 1}/{step["count"]}]', details)
+        server_agent, server_stat_log = stop_server_telemetry(server_agent, clock_offset)
+
+        if iperf3_process.returncode != 0:
+            failures += 1
+            if _has_failed_too_often(step, failures):
+                return server_agent
+            continue
 
-        previous_tcp_bitrates.append(results_json['end']['sum_received']['bits_per_second'] / 1000.0)
-        previous_tcp_bitrate = f'{previous_tcp_bitrates[-1]:.2f} Kbit/s'
+        # Extract per-direction average bitrates and RTTs from test that had just occured.
+        direction_summaries, stream_stats = summarize_iperf3_results(json.loads(iperf3_results))
+        for direction, (bitrate, rtt) in direction_summaries.items():
+            previous_bitrates.setdefault(direction, []).append(bitrate)
+            if rtt is not None:
+                previous_rtts.setdefault(direction, []).append(rtt)
+        total_bitrates.append(sum(bitrate for bitrate, _ in direction_summaries.values()))
 
-        previous_tcp_rtts.append(results_json['end']['streams'][0]['sender']['mean_rtt'] / 1000.0)
-        previous_tcp_rtt = f'{previous_tcp_rtts[-1]:.2f}ms'
+        previous_bitrate = ', '.join(f'{direction}: {bitrate:.2f} Kbit/s' for direction, (bitrate, _) in direction_summaries.items())
+        previous_rtt = ', '.join(f'{direction}: {rtt:.2f}ms' for direction, (_, rtt) in direction_summaries.items() if rtt is not None) or 'N/A'
 
-        write_out_iperf3_result_files(f'{directory}/Iperf3_TCP_Test_{i + 1}', iperf3_results, stat_log)
+        write_out_iperf3_result_files(f'{directory}/Iperf3_{step["name"]}_Test_{i + 1}', iperf3_results, stat_log, server_stat_log, stream_stats)
 
         i += 1
 
-    if IPERF3_TCP_TEST_COUNT > 0:
-        print(f'\033[2K✓ TCP Testing Complete (Average Bitrate: {mean(previous_tcp_bitrates):.2f} Kbit/s, Average RTT: {mean(previous_tcp_rtts):.2f}ms)')
+        if _is_phase_stable(step, total_bitrates):
+            break
+
+    if i > 0:
+        average_bitrates = ', '.join(f'{direction}: {mean(bitrates):.2f} Kbit/s' for direction, bitrates in previous_bitrates.items())
+        if is_tcp:
+            average_rtts = ', '.join(f'{direction}: {mean(rtts):.2f}ms' for direction, rtts in previous_rtts.items()) or 'N/A'
+            print(f'\033[2K✓ {step["name"]} Testing Complete (Average Bitrate: {average_bitrates}, Average RTT: {average_rtts})')
+        else:
+            print(f'\033[2K✓ {step["name"]} Testing Complete (Average Bitrate: {average_bitrates})')
 
-    # Perform latency testing.
-    ping_parameters = [
-        'ping', '-D', '-4',
-        '-c', str(ICMP_PING_TEST_BATCH_SIZE),
-        SERVER_HALOW_IP
-    ]
+    return server_agent
 
+def run_ping_phase(step: dict, session_token: str, device: str, id_counter: Iterator[int], server_agent: Optional[TextIO], directory: str) -> Optional[TextIO]:
     i = 0
+    failures = 0
     stat_log = []
+    server_stat_log = []
     ping_stats = []
+    batch_latencies = []
     latency_sum = 0.0
     average_latency = 'N/A'
-    while i < ICMP_PING_TEST_SAMPLES:
-        ping_process = subprocess.Popen(ping_parameters, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, pipesize=1024**2)
-
-        spinner_index = 0
-        temp_stat_log = []
-        while ping_process.poll() == None:
-            start_time = time.time()
-
-            temp_stat_log.append(get_peer_stats(session_token, device, id_counter := id_counter + 1))
-            rssi = temp_stat_log[-1][1]
-            noise = temp_stat_log[-1][3]
-            snr = rssi - noise
-            
-            if device != BOARD_NAMES[1]:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Gathering ICMP Samples [{i}/{ICMP_PING_TEST_SAMPLES}] (RSSI: {rssi}dBm, Noise Floor: {noise}dBm, SNR: {snr}dB, Average Latency: {average_latency})', end='\033[?7h\r')
-            else:
-                print(f'\033[?7l\033[2K\033[?25l{PROGRESS_SPIN[spinner_index]} Gathering ICMP Samples [{i}/{ICMP_PING_TEST_SAMPLES}] (RSSI: {rssi}dBm, Average Latency: {average_latency})', end='\033[?7h\r')
-            spinner_index = (spinner_index + 1) % len(PROGRESS_SPIN)
-
-            delta_time = time.time() - start_time
-            time.sleep(max(0, UBUS_REPORT_RATE - delta_time))
-
-        lines = ping_process.communicate()[0].split('\n')[1:-5]
-        if len(lines) != ICMP_PING_TEST_BATCH_SIZE:
+    while i < step['samples']:
+        server_agent, clock_offset = start_server_telemetry(server_agent, step['report_rate'])
+        ping_process = subprocess.Popen(step['command'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, pipesize=1024**2)
+        temp_stat_log, ping_output = _monitor_process(ping_process, session_token, device, id_counter, step['report_rate'], f'Gathering ICMP Samples [{i}/{step["samples"]}]', f'Average Latency: {average_latency}')
+        server_agent, temp_server_stat_log = stop_server_telemetry(server_agent, clock_offset)
+
+        lines = ping_output.split('\n')[1:-5]
+        if len(lines) != step['batch_size']:
+            failures += 1
+            if _has_failed_too_often(step, failures):
+                break
             continue
 
         stat_log += temp_stat_log
+        server_stat_log += temp_server_stat_log
 
         for line in lines:
             ping_stats.append(parse_ping_line(line))
-        for x in range(1, ICMP_PING_TEST_BATCH_SIZE + 1):
-            latency_sum += float(ping_stats[-x][4])
-        
+        batch_latencies.append(mean(float(ping_stats[-x][4]) for x in range(1, step['batch_size'] + 1)))
+        latency_sum += batch_latencies[-1] * step['batch_size']
+
         average_latency = f'{(latency_sum / len(ping_stats)):.2f}ms'
 
-        i += ICMP_PING_TEST_BATCH_SIZE
+        i += step['batch_size']
+
+        if _is_phase_stable(step, batch_latencies):
+            break
+
+    write_out_ping_result_files(f'{directory}/Iperf3_{step["name"]}_Test', ping_stats, stat_log, server_stat_log)
+
+    if ping_stats:
+        print(f'\033[2K✓ {step["name"]} Testing Complete (Average Latency: {average_latency})')
+
+    return server_agent
+
+def main() -> None:
+    parser = argparse.ArgumentParser('Halow Tester', description='Automated and streamlined HaLow testing and data collection.')
+    parser.add_argument('-f', '--test-plan', type=str, help='JSON test plan file. The built-in plan is used if omitted.')
+    parser.add_argument('--validate', action='store_true', help='Validate the test plan and exit.')
+
+    args = parser.parse_args()
+
+    test_plan = load_test_plan(args.test_plan) if args.test_plan else make_default_test_plan()
+
+    # Validate everything before touching the radios so a bad plan never stops a campaign part way through.
+    errors = validate_test_plan(test_plan)
+    if errors:
+        for error in errors:
+            print(f'ERROR: {error}')
+        print('ERROR: Invalid test plan. Terminating.')
+        sys.exit(-1)
+
+    if args.validate:
+        print(f'✓ Test plan is valid ({len(test_plan["phases"])} phases)')
+        return
+
+    apply_test_plan_settings(test_plan.get('settings', {}))
+
+    # A single ubus session and device query is shared by every phase in the plan.
+    id_counter = itertools.count()
+    session_token = get_session_token(UBUS_JSONRPC_URL, next(id_counter))
+    device = get_device(UBUS_JSONRPC_URL, session_token, next(id_counter))
+    channel, txpower = get_channel_and_txpower(UBUS_JSONRPC_URL, session_token, device, next(id_counter))
+    bandwidth = CHANNEL_TO_BANDWIDTH[channel]
+
+    schedule = compile_test_plan(test_plan, device, bandwidth)
+
+    directory = f'./results/{make_timestamp()}_{bandwidth}MHz_CH{channel}_{txpower}dBM_halow_test'
+
+    os.mkdir(directory)
+
+    with open(f'{directory}/Test_Plan.json', 'w') as file:
+        json.dump(test_plan, file, indent=4)
 
-    write_out_ping_result_files(f'{directory}/Iperf3_ICMP_Test', ping_stats, stat_log)
+    server_agent = connect_server_agent()
 
-    print(f'\033[2K✓ ICMP Testing Complete (Average Latency: {average_latency})')
+    for step in schedule:
+        if step['type'] == 'iperf3':
+            server_agent = run_iperf3_phase(step, session_token, device, id_counter, server_agent, directory)
+        else:
+            server_agent = run_ping_phase(step, session_token, device, id_counter, server_agent, directory)
 
-    pass
+    if server_agent is not None:
+        server_agent.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file